@@ -2,8 +2,8 @@
 # -*- coding: UTF-8 -*-
 
 # Python standard library
-from __future__ import print_function
-import os, sys, re
+import os, sys
+from collections import defaultdict
 
 # Local imports
 from utils import (
@@ -12,6 +12,14 @@ from utils import (
     fatal
 )
 
+# Normalizes a cell containing multiple
+# groups so it can be split on a comma,
+# semicolons are converted to commas
+_SEMI_TO_COMMA = str.maketrans(';', ',')
+# Leading or trailing characters to
+# remove from each cell in a file
+_CLEAN_CHARS = ' \t\r\n"\''
+
 
 def clean(s, remove=['"', "'"]):
     """Cleans a string to remove any defined leading or trailing characters.
@@ -22,9 +30,48 @@ def clean(s, remove=['"', "'"]):
     @return s <str>:
         Cleaned string
     """
-    for c in remove:
-        s = s.strip(c)
-    return s
+    # Strip all characters in a single
+    # pass rather than once per character
+    return s.strip(''.join(remove))
+
+
+def _read_lines(file, encoding='utf-8'):
+    """Private function: Returns the lines in a file by reading the whole
+    file in one call, decoding it once and splitting it into lines in a
+    single pass. Groups files are small, so the entire file is held in
+    memory. An empty list is returned for an empty file.
+    @param file <str>:
+        Path to file to read.
+    @param encoding <str>:
+        Encoding used to decode the file.
+    @return lines <list[str]>:
+        List of lines in the file, without line terminators.
+    """
+    with open(file, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return []
+        data = fh.read().decode(encoding)
+
+    # Only split on universal newlines,
+    # like iterating over a file opened
+    # in text mode, str.splitlines() also
+    # splits on form feeds, etc.
+    lines = data.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if not lines[-1]:
+        # File ends with a newline
+        lines.pop()
+
+    return lines
+
+
+def _empty(file):
+    """Private function: Reports that a groups file is empty and exits.
+    @param file <str>:
+        Path to groups TSV file.
+    """
+    c = Colors()
+    err('{0}{1}Error: groups file, {2}, is empty!{3}'.format(c.bg_red, c.white, file, c.end))
+    fatal('{0}{1}Please add sample and group information to the file and try again.{2}'.format(c.bg_red, c.white, c.end))
 
 
 def index(file, delim='\t', required = ['sample', 'group']):
@@ -38,34 +85,54 @@ def index(file, delim='\t', required = ['sample', 'group']):
         [0] Dictionary containing information the index of each required/optional column
         [1] Boolean to indicate whether file has a header
     """
+    # Check to see if the file is empty
+    # before opening it to read its header
+    if os.path.getsize(file) == 0:
+        _empty(file)
+    with open(file, 'r') as fh:
+        header_line = fh.readline()
+
+    return index_from_header(header_line, file, delim=delim, required=required)
+
+
+def index_from_header(header_line, file, delim='\t', required = ['sample', 'group']):
+    """Return the index of expected columns given the first line of a file.
+    Allows a caller that has already opened the file to parse its header
+    without opening the file a second time. 
+    @param header_line <str>:
+        First line of the file, callers are expected to check for empty files.
+    @param file <str>:
+        Path to groups TSV file, used for reporting errors or warnings.
+    @return tuple(indices <dict[int/None]>, hasHeader <boolean>):
+        [0] Dictionary containing information the index of each required/optional column
+        [1] Boolean to indicate whether file has a header
+    """
     c = Colors()
     indices = {}
     has_header = True  
     
-    # Check to see if the file is empty
-    fh = open(file, 'r')
-    try:
-        header = [clean(col.lower().strip()) for col in next(fh).strip().split(delim)]
-    except StopIteration:
-        err('{0}{1}Error: groups file, {2}, is empty!{3}'.format(c.bg_red, c.white, file, c.end))
-        fatal('{0}{1}Please add sample and group information to the file and try again.{2}'.format(c.bg_red, c.white, c.end))
-    finally:
-        fh.close()
+    # Strip whitespace, newlines and quotes
+    # from each column name in one pass
+    header = [col.strip(_CLEAN_CHARS).lower() for col in header_line.split(delim)]
     
     # Parse the header to get the index of required fields
-    try:
-        # Get index of sample, group
-        # columns for parsing the file
-        for col in required:
-            col = col.lower()
-            indices[col] = header.index(col)
-    except ValueError:
+    # Get index of sample, group
+    # columns for parsing the file,
+    # in a single pass over the header
+    required_set = {col.lower() for col in required}
+    for i, col in enumerate(header):
+        if col in required_set and col not in indices:
+            indices[col] = i
+    if len(indices) < len(required_set):
+        has_header = False
+        indices = {}
+
+    if not has_header:
         # Missing column names or header in peakcall file
         # This can also occur if the file is not actually 
         # a tab delimited file.
         # TODO: Add a check to see if the file is actually
         # a tab delimited file, i.e. a TSV file.
-        has_header = False
         err(
             '{0}{1}Warning: {2} is missing at least one of the following column names: Sample, Group {3}'.format(
                 c.bg_yellow,
@@ -88,6 +155,101 @@ def index(file, delim='\t', required = ['sample', 'group']):
     return indices, has_header
 
 
+def _parse_groups(lines, s_index, g_index, delim='\t', start=0):
+    """Private generator: Parses the lines of a groups file into sample to
+    groups pairs. This is the inner loop of iter_sample_rows(); it is kept
+    separate from reading the file and its header so it can be swapped out
+    for a compiled implementation with the same interface.
+    @param lines <list[str]>:
+        List of lines in the file, without line terminators.
+    @param s_index <int>:
+        Index of the sample column.
+    @param g_index <int>:
+        Index of the group column.
+    @param start <int>:
+        Index of the first line to parse, i.e. 1 to skip over a header.
+    @yield row <tuple(str, list[str])>:
+        Next parsed row, a tuple containing a sample
+        and a list of the groups it belongs to
+    """
+    c = Colors()
+    # Build the styling for warnings once,
+    # rather than formatting it each time
+    # a line with a warning is found
+    warn_prefix = f'{c.bg_yellow}{c.black}Warning: '
+    warn_suffix = c.end
+    # Only split the line up to the last
+    # column that is needed, any trailing
+    # columns are left in the final item
+    max_index = max(s_index, g_index)
+    maxsplit = max_index + 1
+    for i in range(start, len(lines)):
+        # Keep track of line number
+        # to report where errors or
+        # warnings are coming from
+        lineno = i + 1
+        line = lines[i]
+        linelist = line.split(delim, maxsplit)
+        if len(linelist) <= max_index:
+            # Can occur due to empty lines or
+            # if a user only has 1 column of
+            # information, this checks if the
+            # line is blank to silently continue
+            linelist = [l.strip() for l in line.split(delim)]
+            filtered = [item for item in linelist if item]
+            if filtered:
+                err(f'{warn_prefix}Sample or Group column is missing for line {lineno}: {linelist}, skipping line...{warn_suffix}')
+            continue
+        sample = linelist[s_index].strip(_CLEAN_CHARS)
+        group = linelist[g_index].strip(_CLEAN_CHARS)
+        
+        if not sample or not group: 
+            linelist = [l.strip() for l in line.split(delim)]
+            err(f'{warn_prefix}Sample or Group information is missing for line {lineno}: {linelist}, skipping line...{warn_suffix}')
+            continue # skip over empty string
+        
+        # Check for multiple groups,
+        # split on comma or semicolon,
+        # group names repeat across many
+        # lines so they are interned to
+        # share one string and its hash
+        yield sys.intern(sample), [
+            sys.intern(g.strip(_CLEAN_CHARS)) for g in group.translate(_SEMI_TO_COMMA).split(',')
+        ]
+
+
+def iter_sample_rows(file, delim='\t'):
+    """Reads a sample sheet, groups.tsv, in a single pass and yields each
+    sample with the list of groups it belongs to. The header is detected
+    and skipped over, and lines with missing information are reported and
+    skipped. groups() reduces these rows into a group to samples dictionary;
+    other callers that need sample-level information can consume the same
+    rows without parsing the file again.
+    @param file <str>:
+        Path to groups TSV file.
+    @yield row <tuple(str, list[str])>:
+        Next parsed row, a tuple containing a sample
+        and a list of the groups it belongs to
+    """
+    # Lines are only empty if the size
+    # of the file is zero, reuse that
+    # check rather than checking again
+    lines = _read_lines(file)
+    if not lines:
+        _empty(file)
+    # Get index of each required and
+    # optional column and determine if
+    # the file has a header, if not the
+    # first line is parsed as data
+    indices, header = index_from_header(lines[0], file, delim=delim)
+    s_index = indices['sample']
+    g_index = indices['group']
+    # Skip over header and
+    # start parsing the file
+    start = 1 if header else 0
+    yield from _parse_groups(lines, s_index, g_index, delim, start)
+
+
 def groups(file, delim='\t'):
     """Reads and parses a sample sheet, groups.tsv, into a dictionary. 
     This file acts as a sample sheet to gather sample metadata and define 
@@ -126,75 +288,68 @@ def groups(file, delim='\t'):
         Dictionary containing group to samples, where each key is group 
         and its value is a list of samples belonging to that group
     """
-    # Get index of each required and 
-    # optional column and determine if
-    # the file has a header
-    c = Colors()
-    indices, header = index(file)
-    s_index = indices['sample']
-    g_index = indices['group']
-    # Parse the samples and
-    # grab group information 
+    samples, offsets, group_names = groups_soa(file, delim=delim)
     groups = {}
-    # Keep track of line number
-    # to report where errors or
-    # warnings are coming from
-    lineno = 0
-    with open(file, 'r') as fh:
-        if header:
-            # Skip over header and
-            # start parsing the file
-            lineno += 1
-            _ = next(fh)
-        for line in fh:
-            lineno += 1
-            linelist = [l.strip() for l in line.split(delim)]
-            try:
-                sample = clean(linelist[s_index])
-                group = linelist[g_index]
-            except IndexError:
-                # Can occur due to empty lines or
-                # if a user only has 1 column of
-                # information, this checks if the
-                # line is blank to silently continue
-                filtered = [item for item in linelist if item]
-                if filtered:
-                    err(
-                        '{0}{1}Warning: Sample or Group column is missing for line {2}: {3}, skipping line...{4}'.format(
-                            c.bg_yellow,
-                            c.black,
-                            lineno,
-                            linelist,
-                            c.end
-                        )      
-                    )
-                continue
-            
-            if not sample or not group: 
-                err(
-                    '{0}{1}Warning: Sample or Group information is missing for line {2}: {3}, skipping line...{4}'.format(
-                        c.bg_yellow,
-                        c.black,
-                        lineno,
-                        linelist,
-                        c.end
-                    )
-                )
-                continue # skip over empty string
-            
-            # Check for multiple groups,
-            # split on comma or semicolon
-            multiple_groups = re.split(';|,',group)
-            multiple_groups = [clean(g.strip()) for g in multiple_groups]
-            for g in multiple_groups:
-                if g not in groups:
-                    groups[g] = []
-                if sample not in groups[g]:
-                    groups[g].append(sample)
+    for i, g in enumerate(group_names):
+        groups[g] = samples[offsets[i]:offsets[i+1]]
 
     return groups
 
 
+def groups_soa(file, delim='\t'):
+    """Reads and parses a sample sheet, groups.tsv, into a compressed, flat
+    representation of its groups. Samples of every group are stored back to
+    back in one list, and the samples of the i-th group are found between
+    offsets[i] and offsets[i+1]. Callers that iterate over every group, or
+    that build per-group matrices, can slice or index these lists directly
+    rather than walking a dictionary of many small lists. Please see the
+    groups() function for more information about the groups.tsv file.
+    @Example: groups.tsv
+        Sample          Group
+        Sample_A_rep1	GrpA,GrpAB
+        Sample_B_rep1	GrpB,GrpAB
+    
+    >> samples, offsets, group_names = groups_soa('peakcall.tsv')
+    >> samples
+    ['Sample_A_rep1', 'Sample_A_rep1', 'Sample_B_rep1', 'Sample_B_rep1']
+    >> offsets
+    [0, 1, 3, 4]
+    >> group_names
+    ['GrpA', 'GrpAB', 'GrpB']
+    @param file <str>:
+        Path to peakcall TSV file.
+    @return tuple(samples <list[str]>, offsets <list[int]>, group_names <list[str]>):
+        [0] List of samples in each group, concatenated in order of group_names
+        [1] List of offsets into samples, where group i spans offsets[i]:offsets[i+1]
+        [2] List of group names, in order of first appearance in the file
+    """
+    # Parse the samples and
+    # grab group information 
+    group2samples = defaultdict(list)
+    # Set of samples already added to
+    # each group, avoids a linear scan
+    # of the group's list of samples
+    seen = defaultdict(set)
+    for sample, sample_groups in iter_sample_rows(file, delim=delim):
+        for g in sample_groups:
+            members = seen[g]
+            if sample not in members:
+                members.add(sample)
+                group2samples[g].append(sample)
+
+    # Flatten the samples of each group
+    # into one list with offsets to the
+    # start and end of each group
+    group_names = list(group2samples)
+    samples = []
+    offsets = [0]
+    for g in group_names:
+        samples.extend(group2samples[g])
+        offsets.append(len(samples))
+
+    return samples, offsets, group_names
+
+
 def contrasts(file, groups, delim='\t'):
     """Reads and parses the group comparison file, contrasts.tsv, into a 
     dictionary. This file acts as a config file to setup contrasts between
@@ -217,51 +372,53 @@ def contrasts(file, groups, delim='\t'):
     @param groups list[<str>]:
         List of groups defined in the peakcall file, enforces groups exist.
     @return comparisons <list[list[str, str]]>:
-        Nested list contain comparsions of interest.  
+        Nested list contain comparisons of interest.  
     """
 
     c = Colors()
+    # Build the styling for warnings once,
+    # rather than formatting it each time
+    # a line with a warning is found
+    warn_style = f'{c.bg_yellow}{c.black}'
+    warn_prefix = f'{warn_style}Warning: '
+    warn_suffix = c.end
     errors = []
-    comparsions = []
+    comparisons = []
+    # Set of comparisons already added,
+    # avoids a linear scan over the list
+    # of comparisons for each line
+    seen_pairs = set()
+    # Groups may be provided as a list
+    # or dict keys, use a set for O(1)
+    # membership tests
+    groups = set(groups)
     line_number = 0
     with open(file) as fh:
         for line in fh:
             line_number += 1
-            linelist = [clean(l.strip()) for l in line.split(delim)]
-            try:
-                g1 = linelist[0]
-                g2 = linelist[1]
-                if not g1 or not g2: continue # skip over empty lines
-            except IndexError:
+            linelist = line.split(delim, 2)
+            if len(linelist) < 2:
                 # Missing a group, need two groups to tango
                 # This can happen if the file is NOT a TSV file,
                 # and it is seperated by white spaces, :(  
-                err(
-                '{}{}Warning: {} is missing at least one group on line {}: {}{}'.format(
-                    c.bg_yellow,
-                    c.black,
-                    file,
-                    line_number,
-                    line.strip(),
-                    c.end
-                    )
-                )
-                err('{}{}\t  └── Skipping over line, check if line is tab seperated... {}'.format(
-                    c.bg_yellow,
-                    c.black,
-                    c.end)
-                )
+                err(f'{warn_prefix}{file} is missing at least one group on line {line_number}: {line.strip()}{warn_suffix}')
+                err(f'{warn_style}\t  └── Skipping over line, check if line is tab seperated... {warn_suffix}')
                 continue
+            g1 = linelist[0].strip(_CLEAN_CHARS)
+            g2 = linelist[1].strip(_CLEAN_CHARS)
+            if not g1 or not g2: continue # skip over empty lines
+            pair = (g1, g2)
             # Check to see if groups where defined already,
             # avoids user errors and spelling errors
-            for g in [g1, g2]:
+            for g in pair:
                 if g not in groups:
                     # Collect all error and report them at end
                     errors.append(g)
             
             # Add comparsion to list of comparisons
-            if [g1, g2] not in comparsions:
-                comparsions.append([g1, g2])
+            if pair not in seen_pairs:
+                seen_pairs.add(pair)
+                comparisons.append([g1, g2])
 
     if errors:    
         # One of the groups is not defined in peakcalls
@@ -278,7 +435,7 @@ def contrasts(file, groups, delim='\t'):
             c.end)
         )
     
-    return comparsions
+    return comparisons
 
 
 if __name__ == '__main__':
@@ -288,5 +445,5 @@ if __name__ == '__main__':
     print(group2samples)
     # Testing contrasts file parser
     # print('Parsing contrasts file...')
-    # comparsions = contrasts(sys.argv[2], groups=groups.keys())
-    # print(comparsions)
\ No newline at end of file
+    # comparisons = contrasts(sys.argv[2], groups=groups.keys())
+    # print(comparisons)
\ No newline at end of file